@@ -1,7 +1,8 @@
 # Agents module for Can-Eat-Not multi-agent system
 
-from .trainer import trainer
-from .nutritionist import nutritionist
-from .food_specialist import food_specialist
+from ._llm import configure_llm_cache
+from .trainer import trainer_async
+from .nutritionist import nutritionist_async
+from .food_specialist import food_specialist_async
 
-__all__ = ["trainer", "nutritionist", "food_specialist"]
+__all__ = ["configure_llm_cache", "trainer_async", "nutritionist_async", "food_specialist_async"]
@@ -0,0 +1,86 @@
+from __future__ import annotations
+import os
+from functools import lru_cache
+from typing import Any, Dict, Optional, Type
+import httpx
+from langchain_core.globals import set_llm_cache
+from langchain_core.runnables import Runnable
+from langchain_openai import ChatOpenAI
+from pydantic import BaseModel
+
+DEFAULT_MODEL = "gpt-5-nano"
+# Profile extraction is a small, well-specified task, so it runs on a faster model
+PROFILE_MODEL = "gpt-4o-mini"
+PROFILE_MAX_TOKENS = 200
+LLM_CACHE_PATH = ".caneatnot_llm_cache.db"
+_POOL_LIMITS = httpx.Limits(max_keepalive_connections=20)
+
+
+@lru_cache(maxsize=None)
+def get_llm(model: str = DEFAULT_MODEL, temperature: float = 1, max_tokens: Optional[int] = None) -> ChatOpenAI:
+    """
+    Shared chat model client, built once per (model, temperature, max_tokens) and reused.
+
+    Built lazily rather than at import time so that main.py's load_dotenv()
+    has run before the OpenAI key is read.
+    """
+    return ChatOpenAI(
+        model=model,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        max_retries=2,
+        timeout=30,
+        http_client=httpx.Client(limits=_POOL_LIMITS),
+        http_async_client=httpx.AsyncClient(limits=_POOL_LIMITS),
+    )
+
+
+@lru_cache(maxsize=None)
+def get_structured_llm(
+    schema: Type[BaseModel],
+    model: str = DEFAULT_MODEL,
+    temperature: float = 1,
+    max_tokens: Optional[int] = None,
+) -> Runnable:
+    """
+    get_llm() bound to OpenAI's native json_schema response format, returning `schema` instances.
+    """
+    return get_llm(model, temperature, max_tokens).with_structured_output(schema, method="json_schema", strict=True)
+
+
+def strict_response_format(schema: Type[BaseModel]) -> Dict[str, Any]:
+    """
+    OpenAI json_schema response_format for a flat (non-nested) Pydantic model.
+
+    Used where the raw token stream is needed, e.g. to stream a field to the user,
+    which with_structured_output() would hide behind its parser.
+    """
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": schema.__name__,
+            "strict": True,
+            "schema": {**schema.model_json_schema(), "additionalProperties": False},
+        },
+    }
+
+
+@lru_cache(maxsize=None)
+def configure_llm_cache() -> None:
+    """
+    Install the global LangChain response cache so identical prompts skip the API.
+
+    Uses Redis when LLM_CACHE_REDIS_URL is set (production), otherwise a local SQLite file.
+    Called once at startup, outside the agents' fallbacks, so a broken cache setup fails loudly.
+    """
+    redis_url = os.getenv("LLM_CACHE_REDIS_URL")
+    if redis_url:
+        try:
+            import redis
+        except ImportError as e:
+            raise ImportError("LLM_CACHE_REDIS_URL is set but redis is not installed; install the 'redis' extra") from e
+        from langchain_community.cache import RedisCache
+        set_llm_cache(RedisCache(redis.Redis.from_url(redis_url)))
+    else:
+        from langchain_community.cache import SQLiteCache
+        set_llm_cache(SQLiteCache(database_path=LLM_CACHE_PATH))
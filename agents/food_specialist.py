@@ -1,142 +1,227 @@
 from __future__ import annotations
-import json
-from typing import Dict, Any
-from langchain_openai import ChatOpenAI
-from langchain_core.messages import HumanMessage, SystemMessage
+import logging
+from functools import lru_cache
+from typing import Dict, Any, List, Optional, Tuple
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import Runnable
+from ._llm import get_structured_llm
+from .prompts import system_prompt
+from .schemas import FoodItemAnalysis, FoodSpecialistResponse
+from .nutritionist import ProfileKey, _calculate_basic_metrics, _profile_key
 from state import State, FoodAnalysis
 
-def food_specialist(state: State) -> Dict[str, Any]:
+log = logging.getLogger(__name__)
+
+FOOD_SYSTEM_PROMPT = system_prompt(
+    "Role: food specialist. The food request is the user's own message and may mention other things; "
+    "pick out each food or drink they ask about (a dish like \"mac and cheese\" is one item). For each, "
+    "estimate calories and macros (protein, carbs, fat, fiber, sugar) with specific quantities, how it "
+    "fits the user's weight-loss target, its health pros and cons, and portion and preparation tips for "
+    "this user. Return one analysis per item, with requested_item naming it as the user did."
+)
+
+FOOD_USER_TEMPLATE = """Food Request: "{food_request}"
+
+User Profile:
+- Age: {age}
+- Sex: {sex}
+- Weight: {weight_kg} kg
+- Activity Level: {activity_level}
+- First Meal: {first_meal}
+
+Nutrition Goals:
+- Target Calories: {target_calories} per day
+- BMI: {bmi} ({bmi_class})
+- Recommended Daily Protein: {protein_g}g
+- Recommended Daily Carbs: {carbs_g}g
+- Recommended Daily Fat: {fat_g}g"""
+
+FOOD_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", FOOD_SYSTEM_PROMPT),
+    ("human", FOOD_USER_TEMPLATE),
+])
+
+# Finished LLM-backed results keyed by _food_cache_key(); fallbacks are never stored
+_FOOD_CACHE: Dict[Tuple[str, ProfileKey, Any], Dict[str, Any]] = {}
+
+
+async def food_specialist_async(state: State) -> Dict[str, Any]:
     """
     Enhanced Food Specialist agent - analyzes food requests with full LLM-powered insights.
     """
-    food_request = state.get("food_request", "")
-    user_profile = state.get("user_profile", {})
-    nutrition_profile = state.get("nutrition_profile", {})
+    food_request, user_profile, nutrition_profile = _food_inputs(state)
     
     if not food_request:
-        return {
-            "message": "I need to know what food you want to analyze! Please tell me what you'd like to eat.",
-            "food_analysis": {}
-        }
+        return _NO_FOOD_RESULT
+    
+    # Same food for the same profile as an earlier turn or session: reuse that analysis
+    key = _food_cache_key(food_request, user_profile)
+    cached = _FOOD_CACHE.get(key)
+    if cached is not None:
+        return cached
     
-    # Generate complete LLM-powered food analysis
-    return _generate_complete_food_analysis(food_request, user_profile, nutrition_profile)
+    # Generate complete LLM-powered food analysis; one call picks out and covers every item
+    try:
+        response = await _food_chain().ainvoke(_food_prompt_inputs(food_request, user_profile, nutrition_profile))
+    except Exception as e:
+        log.warning("Error in food specialist LLM call: %s", e)
+        response = None
+    result = _aggregate_food_results(food_request, response, nutrition_profile)
+    # Only real analyses are kept, so a failed call is retried on a later turn
+    if response is not None and response.items:
+        _FOOD_CACHE[key] = result
+    return result
+
+
+def _food_cache_key(food_request: str, user_profile: Dict[str, Any]) -> Tuple[str, ProfileKey, Any]:
+    """Everything the food prompt depends on: the request and the profile fields it shows."""
+    return food_request, _profile_key(user_profile), user_profile.get("first_meal")
+
+
+_NO_FOOD_RESULT = {
+    "message": "I need to know what food you want to analyze! Please tell me what you'd like to eat.",
+    "food_analysis": {}
+}
+
+
+@lru_cache(maxsize=None)
+def _food_chain() -> Runnable:
+    """Prompt piped into the structured food-analysis LLM, built on first use."""
+    return FOOD_PROMPT | get_structured_llm(FoodSpecialistResponse)
+
+
+def _food_inputs(state: State) -> Tuple[str, Dict[str, Any], Dict[str, Any]]:
+    """
+    Pull the normalized food request and user context out of state.
+
+    When the nutritionist is running concurrently there is no nutrition profile yet,
+    so the deterministic basic metrics stand in for the calorie targets.
+    """
+    # Normalized so "Apple " and "apple" share one LLM cache entry
+    food_request = (state.get("food_request") or "").strip().lower()
+    user_profile = state.get("user_profile", {})
+    nutrition_profile = state.get("nutrition_profile") or _calculate_basic_metrics(user_profile)
+    return food_request, user_profile, nutrition_profile
 
 
-def _generate_complete_food_analysis(
+def _food_prompt_inputs(
     food_request: str, 
     user_profile: Dict[str, Any], 
     nutrition_profile: Dict[str, Any]
 ) -> Dict[str, Any]:
-    """Generate complete food analysis using LLM without any database dependency."""
-    
-    system_prompt = """You are a professional food specialist and nutritionist with comprehensive knowledge of food nutrition.
-
-    Analyze the requested food item and provide:
-    1. Accurate caloric and nutritional content based on your knowledge
-    2. Detailed macronutrient breakdown (protein, carbs, fat, fiber, sugar)
-    3. How it fits into the user's dietary goals and weight loss plan
-    4. Health benefits and potential concerns
-    5. Portion size recommendations specific to this user
-    6. Practical tips for preparation or pairing
-    
-    Use your extensive nutritional knowledge to provide accurate estimates. Be specific about quantities and measurements.
-    
-    Respond in a friendly, professional tone with some natural Singlish expressions.
-    
-    Return JSON with:
-    - "message": Your detailed food analysis and recommendations
-    - "food_analysis": Complete food analysis object with all nutritional data
-    - "health_tips": List of 2-3 practical tips related to this food
-    - "portion_recommendation": Specific portion advice for this user's goals
+    """Template variables for FOOD_PROMPT."""
+    macros = nutrition_profile.get("recommended_macros", {})
+    return {
+        "food_request": food_request,
+        "age": user_profile.get("age", "Unknown"),
+        "sex": user_profile.get("sex", "Unknown"),
+        "weight_kg": user_profile.get("weight_kg", "Unknown"),
+        "activity_level": user_profile.get("activity_level", "Unknown"),
+        "first_meal": user_profile.get("first_meal", "Unknown"),
+        "target_calories": nutrition_profile.get("target_calories", "Unknown"),
+        "bmi": nutrition_profile.get("bmi", "Unknown"),
+        "bmi_class": nutrition_profile.get("bmi_class", "Unknown"),
+        "protein_g": macros.get("protein_g", "Unknown"),
+        "carbs_g": macros.get("carbs_g", "Unknown"),
+        "fat_g": macros.get("fat_g", "Unknown"),
+    }
+
+
+def _aggregate_food_results(
+    food_request: str, 
+    response: Optional[FoodSpecialistResponse], 
+    nutrition_profile: Dict[str, Any]
+) -> Dict[str, Any]:
+    """
+    Combine the per-item analyses, one per item name the LLM reported, into one result.
+
+    Only when the call failed or found no item at all does the whole request get
+    the fallback estimate, so no made-up item is ever added to a real analysis.
     """
+    results: Dict[str, Dict[str, Any]] = {}
+    if response is None or not response.items:
+        if response is not None:
+            log.warning("Food specialist found no food items in %r", food_request)
+        fallback = _fallback_food_analysis(food_request, nutrition_profile)
+        results[food_request] = fallback
+        message = fallback["message"]
+    else:
+        for analysis in response.items:
+            name = analysis.requested_item.strip().lower() or food_request
+            key, n = name, 2
+            while key in results:  # Same food listed twice ("an apple ... and another apple")
+                key, n = f"{name} ({n})", n + 1
+            results[key] = _parse_food_analysis(analysis)
+        message = response.message
     
-    user_prompt = f"""Food Request: "{food_request}"
+    return {
+        "message": message,
+        "food_analysis": _combine_food_analyses([result["food_analysis"] for result in results.values()]),
+        "health_tips": [tip for result in results.values() for tip in result["health_tips"]],
+        "portion_recommendation": " ".join(result["portion_recommendation"] for result in results.values())
+    }
 
-User Profile:
-- Age: {user_profile.get('age', 'Unknown')}
-- Sex: {user_profile.get('sex', 'Unknown')}
-- Weight: {user_profile.get('weight_kg', 'Unknown')} kg
-- Activity Level: {user_profile.get('activity_level', 'Unknown')}
-- First Meal: {user_profile.get('first_meal', 'Unknown')}
 
-Nutrition Goals:
-- Target Calories: {nutrition_profile.get('target_calories', 'Unknown')} per day
-- BMI: {nutrition_profile.get('bmi', 'Unknown')} ({nutrition_profile.get('bmi_class', 'Unknown')})
-- Recommended Daily Protein: {nutrition_profile.get('recommended_macros', {}).get('protein_g', 'Unknown')}g
-- Recommended Daily Carbs: {nutrition_profile.get('recommended_macros', {}).get('carbs_g', 'Unknown')}g
-- Recommended Daily Fat: {nutrition_profile.get('recommended_macros', {}).get('fat_g', 'Unknown')}g
+def _combine_food_analyses(food_items: List[FoodAnalysis]) -> FoodAnalysis:
+    """Sum several item analyses into one meal-level analysis for the trainer."""
+    if len(food_items) == 1:
+        return food_items[0]
+    macros: Dict[str, float] = {}
+    for item in food_items:
+        for key, value in item.get("macros", {}).items():
+            macros[key] = macros.get(key, 0) + value
+    
+    return FoodAnalysis(
+        food_item=" + ".join(item["food_item"] for item in food_items),
+        quantity=" + ".join(item["quantity"] for item in food_items),
+        calories_per_unit=sum(item["calories_per_unit"] for item in food_items),
+        total_calories=sum(item["total_calories"] for item in food_items),
+        macros=macros,
+        nutritional_notes=" ".join(item["nutritional_notes"] for item in food_items),
+        health_impact=" ".join(item["health_impact"] for item in food_items)
+    )
 
-Please analyze this food request and provide comprehensive nutritional information and recommendations tailored to this user's weight loss goals."""
 
-    try:
-        llm = ChatOpenAI(model="gpt-5-nano", temperature=1)
-        
-        response = llm.invoke([
-            SystemMessage(content=system_prompt),
-            HumanMessage(content=user_prompt)
-        ])
-        
-        result = json.loads(response.content)
-        
-        # Extract food analysis data from LLM response
-        food_analysis_data = result.get("food_analysis", {})
-        
-        # Create comprehensive food analysis
-        food_analysis = FoodAnalysis(
-            food_item=food_analysis_data.get("food_item", food_request),
-            quantity=food_analysis_data.get("quantity", food_request),
-            calories_per_unit=food_analysis_data.get("calories_per_unit", 0),
-            total_calories=food_analysis_data.get("total_calories", 0),
-            macros=food_analysis_data.get("macros", {
-                "protein_g": 0,
-                "carbs_g": 0,
-                "fat_g": 0,
-                "fiber_g": 0,
-                "sugar_g": 0
-            }),
-            nutritional_notes=food_analysis_data.get("nutritional_notes", "LLM-powered nutritional analysis"),
-            health_impact=food_analysis_data.get("health_impact", "Analyzed using AI nutritional knowledge")
-        )
-        
-        return {
-            "message": result.get("message", f"Complete nutritional analysis for {food_request}."),
-            "food_analysis": food_analysis,
-            "health_tips": result.get("health_tips", []),
-            "portion_recommendation": result.get("portion_recommendation", "")
-        }
-        
-    except Exception as e:
-        print(f"Error in food specialist LLM call: {e}")
-        
-        # Fallback analysis with reasonable estimates
-        target_cals = nutrition_profile.get("target_calories", 2000)
-        estimated_calories = 100  # Conservative estimate
-        
-        food_analysis = FoodAnalysis(
-            food_item=food_request,
-            quantity=food_request,
-            calories_per_unit=estimated_calories,
-            total_calories=estimated_calories,
-            macros={
-                "protein_g": 5.0,
-                "carbs_g": 15.0,
-                "fat_g": 3.0,
-                "fiber_g": 2.0,
-                "sugar_g": 8.0
-            },
-            nutritional_notes=f"Estimated nutritional content for {food_request}. Approximately {estimated_calories} calories.",
-            health_impact="Moderate caloric impact. Consider portion size and daily intake balance."
-        )
-        
-        percentage_of_daily = round((estimated_calories / target_cals) * 100, 1) if target_cals > 0 else 0
-        
-        return {
-            "message": f"Food analysis for {food_request}: Estimated {estimated_calories} calories ({percentage_of_daily}% of your daily target). This is a general estimate - actual values may vary based on preparation and portion size.",
-            "food_analysis": food_analysis,
-            "health_tips": [
-                "Consider portion sizes when eating",
-                "Balance with other nutrients throughout the day"
-            ],
-            "portion_recommendation": "Moderate portion recommended for weight loss goals"
-        }
+def _parse_food_analysis(analysis: FoodItemAnalysis) -> Dict[str, Any]:
+    """Turn one item of the LLM's structured response into a per-item result."""
+    food_analysis = FoodAnalysis(**analysis.food_analysis.model_dump())
+    
+    return {
+        "food_analysis": food_analysis,
+        "health_tips": analysis.health_tips,
+        "portion_recommendation": analysis.portion_recommendation
+    }
+
+
+def _fallback_food_analysis(food_request: str, nutrition_profile: Dict[str, Any]) -> Dict[str, Any]:
+    """Conservative estimate used when the LLM call fails."""
+    target_cals = nutrition_profile.get("target_calories", 2000)
+    estimated_calories = 100  # Conservative estimate
+    
+    food_analysis = FoodAnalysis(
+        food_item=food_request,
+        quantity=food_request,
+        calories_per_unit=estimated_calories,
+        total_calories=estimated_calories,
+        macros={
+            "protein_g": 5.0,
+            "carbs_g": 15.0,
+            "fat_g": 3.0,
+            "fiber_g": 2.0,
+            "sugar_g": 8.0
+        },
+        nutritional_notes=f"Estimated nutritional content for {food_request}. Approximately {estimated_calories} calories.",
+        health_impact="Moderate caloric impact. Consider portion size and daily intake balance."
+    )
+    
+    percentage_of_daily = round((estimated_calories / target_cals) * 100, 1) if target_cals > 0 else 0
+    
+    return {
+        "message": f"Food analysis for {food_request}: Estimated {estimated_calories} calories ({percentage_of_daily}% of your daily target). This is a general estimate - actual values may vary based on preparation and portion size.",
+        "food_analysis": food_analysis,
+        "health_tips": [
+            "Consider portion sizes when eating",
+            "Balance with other nutrients throughout the day"
+        ],
+        "portion_recommendation": "Moderate portion recommended for weight loss goals"
+    }
@@ -1,52 +1,143 @@
 from __future__ import annotations
-import json
-from typing import Dict, Any, Literal
-from langchain_openai import ChatOpenAI
-from langchain_core.messages import HumanMessage, SystemMessage
+import logging
+from functools import lru_cache
+from typing import Dict, Any, Literal, Tuple
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import Runnable
+from ._llm import get_structured_llm
+from .prompts import system_prompt as _system_prompt
+from .schemas import NutritionistResponse
 from state import State, NutritionProfile
 
+log = logging.getLogger(__name__)
+
 Activity = Literal["sedentary", "light", "moderate", "active", "very_active"]
+ProfileKey = Tuple[Any, Any, Any, Any, Any]
+
+# Activity multipliers for TDEE calculation
+_ACTIVITY_MULT: Dict[Activity, float] = {
+    "sedentary": 1.2,
+    "light": 1.375,
+    "moderate": 1.55,
+    "active": 1.725,
+    "very_active": 1.9,
+}
+
+NUTRITION_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", _system_prompt(
+        "Role: nutritionist. From the profile and calculated metrics, give a health assessment, "
+        "personalised and sustainable weight-loss advice, and insights on their metabolism."
+    )),
+    ("human", """User Profile:
+Age: {age}
+Sex: {sex}
+Height: {height_cm} cm
+Weight: {weight_kg} kg
+Activity Level: {activity_level}
+First Meal: {first_meal}
+
+Calculated Metrics:
+BMI: {bmi} ({bmi_class})
+BMR: {bmr} calories/day
+TDEE: {tdee} calories/day
+Target Calories: {target_calories} calories/day
+Recommended Macros: {recommended_macros}"""),
+])
+
+HEALTH_ASSESSMENTS = {
+    "underweight": "Your BMI indicates you're underweight. Focus on healthy weight gain with nutrient-dense foods.",
+    "normal": "Great! Your BMI is in the healthy range. Maintain this with balanced nutrition and regular exercise.",
+    "overweight": "Your BMI indicates you're overweight. A gradual weight loss approach will help you reach a healthier weight.",
+    "obese": "Your BMI indicates obesity. Consider consulting a healthcare provider for a comprehensive weight management plan.",
+}
+
+# Finished nutritionist results keyed by _profile_key(); lru_cache can't key on the profile dict itself
+_ANALYSIS_CACHE: Dict[ProfileKey, Dict[str, Any]] = {}
+
 
-def nutritionist(state: State) -> Dict[str, Any]:
+async def nutritionist_async(state: State) -> Dict[str, Any]:
     """
-    Enhanced Nutritionist agent - analyzes user profile and provides intelligent nutritional assessment using LLM.
+    Enhanced Nutritionist agent - analyzes user profile and provides nutritional assessment.
+
+    The health assessment is a deterministic lookup on the BMI class; the LLM is only
+    consulted when the user asked for a detailed analysis or meal plan.
     """
     user_profile = state.get("user_profile", {})
     
     # First calculate basic metrics
     basic_nutrition = _calculate_basic_metrics(user_profile)
     
-    # Then enhance with LLM analysis
-    enhanced_analysis = _generate_enhanced_analysis(user_profile, basic_nutrition)
+    if not state.get("wants_detailed_analysis"):
+        return _nutritionist_result(user_profile, _rule_based_analysis(basic_nutrition), basic_nutrition)
     
-    return {
+    # Same profile as an earlier turn: reuse that analysis instead of another LLM call
+    cached = _ANALYSIS_CACHE.get(_profile_key(user_profile))
+    if cached is not None:
+        return cached
+    
+    # Then enhance with LLM analysis
+    enhanced_analysis = await _generate_enhanced_analysis(user_profile, basic_nutrition)
+    return _nutritionist_result(user_profile, enhanced_analysis, basic_nutrition)
+
+
+def _nutritionist_result(
+    user_profile: Dict[str, Any], 
+    enhanced_analysis: Dict[str, Any], 
+    basic_nutrition: NutritionProfile
+) -> Dict[str, Any]:
+    """
+    Shape the agent's return value from the LLM or rule-based analysis.
+
+    LLM-backed results are cached per profile; rule-based ones are not, so a failed
+    LLM call is retried on a later turn.
+    """
+    result = {
         "message": enhanced_analysis.get("message", "Nutritional analysis complete."),
         "nutrition_profile": enhanced_analysis.get("nutrition_profile", basic_nutrition)
     }
+    if not enhanced_analysis.get("rule_based"):
+        _ANALYSIS_CACHE[_profile_key(user_profile)] = result
+    return result
+
+
+def _profile_key(profile: Dict[str, Any]) -> ProfileKey:
+    """Hashable key of the profile fields the analysis depends on."""
+    return (
+        profile.get("age"),
+        profile.get("sex"),
+        profile.get("height_cm"),
+        profile.get("weight_kg"),
+        profile.get("activity_level"),
+    )
 
 
 def _calculate_basic_metrics(profile: Dict[str, Any]) -> NutritionProfile:
     """Calculate basic nutritional metrics (BMI, BMR, TDEE, etc.)"""
+    metrics = _basic_metrics(*_profile_key(profile))
+    # Copy so callers can't mutate the cached entry
+    return NutritionProfile({**metrics, "recommended_macros": dict(metrics["recommended_macros"])})
+
+
+@lru_cache(maxsize=128)
+def _basic_metrics(age: Any, sex: Any, height_cm: Any, weight_kg: Any, activity_level: Any) -> NutritionProfile:
+    """Basic metrics for one profile; a pure function of its arguments, so memoized."""
     try:
-        weight = float(profile["weight_kg"])
-        height_m = float(profile["height_cm"]) / 100.0
-        age = int(profile["age"])
-        sex = profile["sex"]
-        activity_level = profile["activity_level"]
+        if sex is None or activity_level is None:
+            raise ValueError("profile is missing sex or activity level")
+        weight = float(weight_kg)
+        height_cm = float(height_cm)
+        age = int(age)
         
         # Calculate BMI
-        bmi = round(weight / (height_m ** 2), 2)
+        height_m = height_cm * 0.01
+        bmi = round(weight / (height_m * height_m), 2)
         bmi_class = _get_bmi_class(bmi)
         
         # Calculate BMR using Mifflin-St Jeor Equation
-        if sex == "male":
-            bmr = 10 * weight + 6.25 * (height_m * 100) - 5 * age + 5
-        else:
-            bmr = 10 * weight + 6.25 * (height_m * 100) - 5 * age - 161
+        bmr = 10 * weight + 6.25 * height_cm - 5 * age + (5 if sex == "male" else -161)
         
         # Calculate TDEE
-        activity_multiplier = _get_activity_multiplier(activity_level)
-        tdee = bmr * activity_multiplier
+        tdee = bmr * _ACTIVITY_MULT.get(activity_level, 1.2)
         
         # Calculate target calories for weight loss (500 cal deficit, minimum 1200)
         target_calories = max(int(round(tdee - 500)), 1200)
@@ -65,10 +156,10 @@ def _calculate_basic_metrics(profile: Dict[str, Any]) -> NutritionProfile:
             tdee=round(tdee, 1),
             target_calories=target_calories,
             recommended_macros=recommended_macros,
-            health_assessment=""  # Will be filled by LLM
+            health_assessment=""  # Filled from HEALTH_ASSESSMENTS, or by the LLM on a detailed analysis
         )
         
-    except (KeyError, ValueError, TypeError) as e:
+    except (ValueError, TypeError) as e:
         # Fallback values if calculation fails
         return NutritionProfile(
             bmi=22.0,
@@ -81,90 +172,65 @@ def _calculate_basic_metrics(profile: Dict[str, Any]) -> NutritionProfile:
         )
 
 
-def _generate_enhanced_analysis(user_profile: Dict[str, Any], basic_nutrition: NutritionProfile) -> Dict[str, Any]:
+async def _generate_enhanced_analysis(user_profile: Dict[str, Any], basic_nutrition: NutritionProfile) -> Dict[str, Any]:
     """Generate enhanced nutritional analysis using LLM."""
-    
-    system_prompt = """You are a professional nutritionist with expertise in weight management and healthy eating. 
-    
-    Analyze the user's profile and basic nutritional metrics to provide:
-    1. Health assessment based on BMI and other factors
-    2. Personalized recommendations for their weight loss journey
-    3. Insights about their metabolic profile
-    4. Practical advice in a friendly, encouraging tone
-    
-    Consider:
-    - Their current BMI status and health implications
-    - Age and sex-specific nutritional needs
-    - Activity level and caloric requirements
-    - Realistic and sustainable weight loss approach
-    
-    Respond in a professional but warm tone. Use some Singlish expressions naturally but keep it informative.
-    
-    Return JSON with:
-    - "message": Your detailed nutritional analysis and recommendations
-    - "nutrition_profile": Enhanced nutrition profile with "health_assessment" field filled
-    - "key_insights": List of 3-4 key insights about their profile
-    """
-    
-    user_prompt = f"""User Profile:
-Age: {user_profile.get('age', 'Unknown')}
-Sex: {user_profile.get('sex', 'Unknown')}
-Height: {user_profile.get('height_cm', 'Unknown')} cm
-Weight: {user_profile.get('weight_kg', 'Unknown')} kg
-Activity Level: {user_profile.get('activity_level', 'Unknown')}
-First Meal: {user_profile.get('first_meal', 'Unknown')}
+    try:
+        response = await _analysis_chain().ainvoke(_analysis_inputs(user_profile, basic_nutrition))
+        return _parse_enhanced_analysis(response, basic_nutrition)
+    except Exception as e:
+        log.warning("Error in nutritionist LLM call: %s", e)
+        return _rule_based_analysis(basic_nutrition)
 
-Calculated Metrics:
-BMI: {basic_nutrition['bmi']} ({basic_nutrition['bmi_class']})
-BMR: {basic_nutrition['bmr']} calories/day
-TDEE: {basic_nutrition['tdee']} calories/day
-Target Calories: {basic_nutrition['target_calories']} calories/day
-Recommended Macros: {basic_nutrition['recommended_macros']}
 
-Provide your professional nutritional analysis and recommendations."""
+@lru_cache(maxsize=None)
+def _analysis_chain() -> Runnable:
+    """Nutrition prompt piped into the structured LLM, built on first use."""
+    return NUTRITION_PROMPT | get_structured_llm(NutritionistResponse)
 
-    try:
-        llm = ChatOpenAI(model="gpt-5-nano", temperature=1)
-        
-        response = llm.invoke([
-            SystemMessage(content=system_prompt),
-            HumanMessage(content=user_prompt)
-        ])
-        
-        result = json.loads(response.content)
-        
-        # Merge the enhanced nutrition profile with basic metrics
-        enhanced_nutrition = {**basic_nutrition}
-        if "nutrition_profile" in result and "health_assessment" in result["nutrition_profile"]:
-            enhanced_nutrition["health_assessment"] = result["nutrition_profile"]["health_assessment"]
-        
-        return {
-            "message": result.get("message", "Nutritional analysis complete."),
-            "nutrition_profile": enhanced_nutrition,
-            "key_insights": result.get("key_insights", [])
-        }
-        
-    except Exception as e:
-        print(f"Error in nutritionist LLM call: {e}")
-        
-        # Fallback analysis
-        bmi_status = basic_nutrition["bmi_class"]
-        if bmi_status == "underweight":
-            health_msg = "Your BMI indicates you're underweight. Focus on healthy weight gain with nutrient-dense foods."
-        elif bmi_status == "normal":
-            health_msg = "Great! Your BMI is in the healthy range. Maintain this with balanced nutrition and regular exercise."
-        elif bmi_status == "overweight":
-            health_msg = "Your BMI indicates you're overweight. A gradual weight loss approach will help you reach a healthier weight."
-        else:  # obese
-            health_msg = "Your BMI indicates obesity. Consider consulting a healthcare provider for a comprehensive weight management plan."
-        
-        enhanced_nutrition = {**basic_nutrition}
-        enhanced_nutrition["health_assessment"] = health_msg
-        
-        return {
-            "message": f"Based on your profile: BMI {basic_nutrition['bmi']} ({bmi_status}), BMR {basic_nutrition['bmr']} cal/day, TDEE {basic_nutrition['tdee']} cal/day. Target: {basic_nutrition['target_calories']} cal/day for weight loss. {health_msg}",
-            "nutrition_profile": enhanced_nutrition
-        }
+
+def _analysis_inputs(user_profile: Dict[str, Any], basic_nutrition: NutritionProfile) -> Dict[str, Any]:
+    """Template variables for NUTRITION_PROMPT."""
+    return {
+        "age": user_profile.get("age", "Unknown"),
+        "sex": user_profile.get("sex", "Unknown"),
+        "height_cm": user_profile.get("height_cm", "Unknown"),
+        "weight_kg": user_profile.get("weight_kg", "Unknown"),
+        "activity_level": user_profile.get("activity_level", "Unknown"),
+        "first_meal": user_profile.get("first_meal", "Unknown"),
+        "bmi": basic_nutrition["bmi"],
+        "bmi_class": basic_nutrition["bmi_class"],
+        "bmr": basic_nutrition["bmr"],
+        "tdee": basic_nutrition["tdee"],
+        "target_calories": basic_nutrition["target_calories"],
+        "recommended_macros": basic_nutrition["recommended_macros"],
+    }
+
+
+def _parse_enhanced_analysis(response: NutritionistResponse, basic_nutrition: NutritionProfile) -> Dict[str, Any]:
+    """Merge the LLM's structured response with the basic metrics."""
+    enhanced_nutrition = {**basic_nutrition}
+    enhanced_nutrition["health_assessment"] = response.health_assessment
+    
+    return {
+        "message": response.message,
+        "nutrition_profile": enhanced_nutrition,
+        "key_insights": response.key_insights
+    }
+
+
+def _rule_based_analysis(basic_nutrition: NutritionProfile) -> Dict[str, Any]:
+    """Deterministic analysis: the default path, and the fallback when the LLM call fails."""
+    bmi_status = basic_nutrition["bmi_class"]
+    health_msg = HEALTH_ASSESSMENTS.get(bmi_status, HEALTH_ASSESSMENTS["obese"])
+    
+    enhanced_nutrition = {**basic_nutrition}
+    enhanced_nutrition["health_assessment"] = health_msg
+    
+    return {
+        "rule_based": True,
+        "message": f"Based on your profile: BMI {basic_nutrition['bmi']} ({bmi_status}), BMR {basic_nutrition['bmr']} cal/day, TDEE {basic_nutrition['tdee']} cal/day. Target: {basic_nutrition['target_calories']} cal/day for weight loss. {health_msg}",
+        "nutrition_profile": enhanced_nutrition
+    }
 
 
 def _get_bmi_class(bmi: float) -> str:
@@ -177,15 +243,3 @@ def _get_bmi_class(bmi: float) -> str:
         return "overweight"
     else:
         return "obese"
-
-
-def _get_activity_multiplier(level: Activity) -> float:
-    """Get activity multiplier for TDEE calculation."""
-    multipliers = {
-        "sedentary": 1.2,
-        "light": 1.375,
-        "moderate": 1.55,
-        "active": 1.725,
-        "very_active": 1.9,
-    }
-    return multipliers.get(level, 1.2)
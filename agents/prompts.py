@@ -0,0 +1,29 @@
+# Prompt text shared by all agents.
+#
+# Every system prompt is sent on every turn, so they are kept short: the output
+# structure travels as the json_schema response format (see schemas.py), and
+# guidance the model already follows by default is left out.
+
+from typing import Any
+import orjson
+
+SHARED_SYSTEM = (
+    "You are part of Can-Eat-Not, a weight-loss assistant for Singaporeans. "
+    "Be accurate, concise and encouraging, in friendly English with light Singlish (lah, leh). "
+    "Give no medical diagnoses."
+)
+
+
+def system_prompt(role_prompt: str) -> str:
+    """Prefix an agent's role prompt with the shared guardrails."""
+    return f"{SHARED_SYSTEM}\n{role_prompt}"
+
+
+def render_json(data: Any) -> str:
+    """
+    Compact JSON for embedding data in prompts.
+
+    Keys are sorted so the same data always renders to the same text, which keeps
+    prompts byte-identical across turns for the LLM response cache.
+    """
+    return orjson.dumps(data, option=orjson.OPT_SORT_KEYS).decode()
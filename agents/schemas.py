@@ -0,0 +1,68 @@
+from __future__ import annotations
+from typing import List, Literal, Optional
+from pydantic import BaseModel, Field
+
+# Response schemas for OpenAI structured outputs (json_schema, strict=True).
+# Strict mode requires every field to be present, so "unknown" values are nullable
+# rather than omitted.
+
+
+class Macros(BaseModel):
+    protein_g: float
+    carbs_g: float
+    fat_g: float
+    fiber_g: float
+    sugar_g: float
+
+
+class FoodAnalysisOutput(BaseModel):
+    food_item: str
+    quantity: str
+    calories_per_unit: int
+    total_calories: int
+    macros: Macros
+    nutritional_notes: str
+    health_impact: str
+
+
+class FoodItemAnalysis(BaseModel):
+    """Food specialist's analysis of one requested food item."""
+    requested_item: str = Field(description="The food or drink as the user named it, e.g. \"2 slices of pizza\"")
+    food_analysis: FoodAnalysisOutput
+    health_tips: List[str] = Field(description="2-3 practical tips related to this food")
+    portion_recommendation: str = Field(description="Specific portion advice for this user's goals")
+
+
+class FoodSpecialistResponse(BaseModel):
+    """Food specialist's analysis of every requested food item, from one call."""
+    message: str = Field(description="Your detailed food analysis and recommendations, covering every item")
+    items: List[FoodItemAnalysis] = Field(description="One analysis per food or drink the user asked about")
+
+
+class NutritionistResponse(BaseModel):
+    """Nutritionist's assessment of the user's profile."""
+    message: str = Field(description="Your detailed nutritional analysis and recommendations")
+    health_assessment: str = Field(description="Short health assessment based on BMI and other factors")
+    key_insights: List[str] = Field(description="3-4 key insights about their profile")
+
+
+class ExtractedProfile(BaseModel):
+    age: Optional[int]
+    sex: Optional[Literal["male", "female"]]
+    height_cm: Optional[float]
+    weight_kg: Optional[float]
+    activity_level: Optional[Literal["sedentary", "light", "moderate", "active", "very_active"]]
+    first_meal: Optional[bool] = Field(description="Is this their first meal of the day?")
+
+
+class TrainerResponse(BaseModel):
+    """Trainer's reply during profile collection; completion and waiting are derived from the profile."""
+    message: str = Field(description="Your response to the user")
+    user_profile: ExtractedProfile = Field(description="Profile with any new info extracted; null for unknown fields")
+
+
+class FinalRecommendation(BaseModel):
+    """Trainer's final can-eat-or-not verdict."""
+    message: str = Field(description="Your final recommendation")
+    final_recommendation: str = Field(description="Summary of your advice")
+    can_eat_verdict: bool = Field(description="true/false based on analysis")
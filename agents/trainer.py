@@ -1,273 +1,426 @@
 from __future__ import annotations
-import json
-from typing import Dict, Any, Optional
-from langchain_openai import ChatOpenAI
-from langchain_core.messages import HumanMessage, SystemMessage
-from state import State, UserProfile
+import logging
+import re
+from functools import lru_cache
+from typing import Callable, Dict, Any, List, Optional, Tuple
+from langchain_core.output_parsers import JsonOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import Runnable
+from ._llm import PROFILE_MAX_TOKENS, PROFILE_MODEL, get_llm, get_structured_llm, strict_response_format
+from .prompts import render_json, system_prompt as _system_prompt
+from .schemas import TrainerResponse, FinalRecommendation
+from state import State, Message, UserProfile
 
-def trainer(state: State) -> Dict[str, Any]:
+log = logging.getLogger(__name__)
+
+REQUIRED_FIELDS = ["age", "sex", "height_cm", "weight_kg", "activity_level", "first_meal"]
+
+_FIELD_QUESTIONS = {
+    "age": "What's your age?",
+    "sex": "Are you male or female?",
+    "height_cm": "What's your height in cm?",
+    "weight_kg": "What's your current weight in kg?",
+    "activity_level": "How active are you? (sedentary/light/moderate/active/very_active)",
+    "first_meal": "Is this your first meal of the day?",
+}
+
+# Opening message; the first turn has nothing for the LLM to work with, so it is never generated
+GREETING_TEMPLATE = "Hi there! I'm your fitness trainer lah! Let's see if you can eat that food. First, tell me a bit about yourself: {questions}"
+_GREETING_MESSAGE = GREETING_TEMPLATE.format(questions=" ".join(_FIELD_QUESTIONS[field] for field in REQUIRED_FIELDS))
+
+
+_UNIT_RE = re.compile(r"\b(\d{1,3}(?:\.\d+)?)\s*(cm|kg|years?|yrs?|yo)\b", re.I)
+_UNIT_FIELDS = {"cm": "height_cm", "kg": "weight_kg", "year": "age", "yr": "age", "yo": "age"}
+_SEX_RE = re.compile(r"\b(male|female|man|woman|guy|girl)\b", re.I)
+_SEX_WORDS = {"male": "male", "man": "male", "guy": "male", "female": "female", "woman": "female", "girl": "female"}
+_ACTIVITY_RE = re.compile(r"\b(sedentary|light|moderate|very[ _]active|active)\b", re.I)
+# Words that carry no profile information once the values above are removed
+_FILLER_WORDS = {
+    "i", "i'm", "im", "am", "a", "an", "and", "my", "is", "it's", "its", "age", "old", "sex",
+    "height", "tall", "weight", "weigh", "about", "around", "activity", "level", "lah", "leh", "ok",
+}
+
+PROFILE_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", _system_prompt(
+        "Role: fitness trainer collecting the user's profile: age (1-120), sex, height_cm (80-250), "
+        "weight_kg (20-400), activity_level, first_meal (first meal of the day?).\n"
+        "Known: {profile_json}. Missing: {missing_fields}.\n"
+        "Greet warmly on first contact. Extract every field the user mentions and ask for all "
+        "missing ones in one message. Note any food mentioned but finish the profile first."
+    )),
+    ("human", """Conversation so far:
+{conversation_context}
+
+User just said: "{user_input}"
+"""),
+])
+
+FINAL_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", _system_prompt(
+        "Role: fitness trainer giving the final verdict. Weigh the food's calories and nutrients "
+        "against the user's target calories and weight-loss goal. Give a clear can-eat or avoid "
+        "verdict, reasoning from the data, practical balancing tips and encouragement."
+    )),
+    ("human", """User Profile: {profile_json}
+Nutrition Analysis: {nutrition_json}
+Food Analysis: {food_json}"""),
+])
+
+# Profile validation tables: numeric fields as (cast, min, max), enums as allowed values
+_RANGE_VALIDATORS = {
+    "age": (int, 1, 120),
+    "height_cm": (float, 80, 250),
+    "weight_kg": (float, 20, 400),
+}
+_ENUM_VALIDATORS = {
+    "sex": {"male", "female"},
+    "activity_level": {"sedentary", "light", "moderate", "active", "very_active"},
+}
+_TRUE_VALUES = {True, "true", "yes", "y", "first"}
+_FALSE_VALUES = {False, "false", "no", "n", "not first"}
+
+# State read by trainer_async(), unpacked in this order
+_TRAINER_STATE_KEYS = (
+    "profile_complete", "current_user_input", "user_profile", "nutrition_profile",
+    "food_analysis", "food_request", "final_recommendation", "profile_json",
+    "wants_detailed_analysis",
+)
+
+
+async def trainer_async(state: State, on_message_chunk: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
     """
     Enhanced Trainer agent - handles profile collection, food requests, and final recommendations using LLM.
+
+    If on_message_chunk is given, the final recommendation's message is streamed to it as it is
+    generated and the result carries "streamed": True.
+    """
+    step, args = _trainer_step(state)
+    if step == "final":
+        return await _generate_final_recommendation(*args, on_message_chunk)
+    if step == "profile":
+        return _with_profile_json(await _handle_profile_collection(*args))
+    return args
+
+
+def _trainer_step(state: State) -> Tuple[str, Any]:
+    """
+    Decide what the trainer does next.
+
+    Returns ("final", args) or ("profile", args) for the LLM-backed steps, or
+    ("reply", result) when the reply needs no LLM call. trainer_node waits for the user
+    on "awaiting_food_request"/"awaiting_user_input" and otherwise hands over.
     """
-    current_phase = state.get("current_phase", "greeting")
-    profile_complete = state.get("profile_complete", False)
-    user_input = state.get("current_user_input", "")
-    user_profile = state.get("user_profile", {})
-    has_nutrition_profile = bool(state.get("nutrition_profile"))
-    has_food_analysis = bool(state.get("food_analysis"))
-    food_request = state.get("food_request")
+    (profile_complete, user_input, user_profile, nutrition_profile,
+     food_analysis, food_request, final_recommendation, profile_json,
+     wants_detailed_analysis) = map(state.get, _TRAINER_STATE_KEYS)
+    user_profile = user_profile or {}
+    
+    log.debug("Trainer called - Profile: %s, Nutrition: %s, Food Request: %s, Food Analysis: %s",
+              profile_complete, bool(nutrition_profile), bool(food_request), bool(food_analysis))
     
-    print(f"🧑‍🏫 Trainer called - Profile: {profile_complete}, Nutrition: {has_nutrition_profile}, Food Request: {bool(food_request)}, Food Analysis: {has_food_analysis}")
+    # First contact: greet from the template and ask for the whole profile
+    if state.get("current_phase") == "greeting":
+        log.debug("Trainer: Greeting")
+        return "reply", _greeting_reply()
     
     # If we have everything needed, provide final recommendation
-    if (profile_complete and has_nutrition_profile and has_food_analysis and 
-        not state.get("final_recommendation")):
-        print("🧑‍🏫 Trainer: Generating final recommendation")
-        return _generate_final_recommendation(state)
+    if profile_complete and nutrition_profile and food_analysis and not final_recommendation:
+        log.debug("Trainer: Generating final recommendation")
+        profile_json = profile_json or render_json(user_profile)
+        return "final", (profile_json, nutrition_profile, food_analysis)
+    
+    # Meal plan or detailed analysis requested: hand straight back to the nutritionist
+    if profile_complete and nutrition_profile and wants_detailed_analysis:
+        log.debug("Trainer: Detailed analysis requested - handing to nutritionist")
+        return "reply", {
+            "message": "Let me get our nutritionist to go through that in detail for you!"
+        }
     
-    # If we have a food request but no analysis, we should NOT be here - routing should go to food specialist
-    if food_request and not has_food_analysis:
-        print("🧑‍🏫 Trainer: Food request detected but no analysis - this should go to food specialist!")
-        return {
-            "message": "Let me get our food specialist to analyze that for you!",
-            "awaiting_user_input": False
+    # Food request waiting on a complete profile: hand over to the food specialist. Before the
+    # profile is complete the request stays pending and profile collection continues below;
+    # the turn that completes it fans out to the nutritionist and food specialist together
+    if profile_complete and food_request and not food_analysis:
+        log.debug("Trainer: Food request detected but no analysis - handing to food specialist")
+        return "reply", {
+            "message": "Let me get our food specialist to analyze that for you!"
         }
     
     # If profile complete and nutrition done but no food request, ask for food
-    if profile_complete and has_nutrition_profile and not food_request:
-        print("🧑‍🏫 Trainer: Asking for food request")
-        return _ask_for_food_request(state)
+    if profile_complete and nutrition_profile and not food_request:
+        log.debug("Trainer: Asking for food request")
+        return "reply", _ask_for_food_request(nutrition_profile)
     
     # Otherwise, handle profile collection
-    print("🧑‍🏫 Trainer: Handling profile collection")
-    return _handle_profile_collection(state, user_input, user_profile)
+    log.debug("Trainer: Handling profile collection")
+    return "profile", (state.get("messages", []), user_input or "", user_profile)
+
+
+def _with_profile_json(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Render the finished profile once; later prompts reuse the string from state."""
+    if result.get("profile_complete"):
+        result["profile_json"] = render_json(result["user_profile"])
+    return result
 
 
-def _handle_profile_collection(state: State, user_input: str, current_profile: Dict[str, Any]) -> Dict[str, Any]:
+async def _handle_profile_collection(messages: List[Message], user_input: str, current_profile: Dict[str, Any]) -> Dict[str, Any]:
     """Handle profile collection with LLM assistance."""
+    current_profile, missing_fields, reply = _profile_prepass(user_input, current_profile)
+    if reply:
+        return reply
     
+    try:
+        response = await _profile_chain().ainvoke(_profile_inputs(messages, user_input, current_profile, missing_fields))
+        return _parse_profile_response(response, current_profile)
+    except Exception as e:
+        log.warning("Error in trainer LLM call: %s", e)
+        return _fallback_profile_reply(current_profile, missing_fields)
+
+
+def _profile_prepass(
+    user_input: str, 
+    current_profile: Dict[str, Any]
+) -> Tuple[Dict[str, Any], List[str], Optional[Dict[str, Any]]]:
+    """
+    Merge what the heuristic finds into the profile.
+
+    Returns the merged profile, the fields still missing, and a ready reply when
+    no LLM call is needed.
+    """
+    # Cheap first pass: pick up "175cm", "70 kg", "25 years", "male", ... without an LLM call
+    heuristic_profile, fully_parsed = _extract_profile_heuristic(user_input)
+    if not fully_parsed:
+        # Activity words are unreliable out of context ("not very active", "light jogging"),
+        # so only a reply that is nothing but the level is trusted; otherwise the LLM decides
+        heuristic_profile.pop("activity_level", None)
+    current_profile = {**current_profile, **heuristic_profile}
+    
+    # Check what profile fields we still need
+    missing_fields = _missing_fields(current_profile)
+    
+    # Only call the LLM when the input held something the heuristic could not place
+    if heuristic_profile and fully_parsed:
+        return current_profile, missing_fields, _profile_progress_reply(current_profile, missing_fields)
+    return current_profile, missing_fields, None
+
+
+def _profile_inputs(
+    messages: List[Message], 
+    user_input: str, 
+    current_profile: Dict[str, Any], 
+    missing_fields: List[str]
+) -> Dict[str, Any]:
+    """Template variables for PROFILE_PROMPT."""
     # Build conversation context
-    messages = state.get("messages", [])
     conversation_context = ""
     for msg in messages[-5:]:  # Last 5 messages for context
-        conversation_context += f"{msg['role']}: {msg['content']}\n"
+        conversation_context += f"{msg.role}: {msg.content}\n"
     
-    # Check what profile fields we still need
-    required_fields = ["age", "sex", "height_cm", "weight_kg", "activity_level", "first_meal"]
-    missing_fields = [field for field in required_fields if field not in current_profile]
+    return {
+        "profile_json": render_json(current_profile),
+        "missing_fields": ", ".join(missing_fields),
+        "conversation_context": conversation_context,
+        "user_input": user_input,
+    }
+
+
+def _parse_profile_response(response: TrainerResponse, current_profile: Dict[str, Any]) -> Dict[str, Any]:
+    """Merge the LLM's validated extraction into the profile."""
+    result = response.model_dump()
     
-    system_prompt = f"""You are a friendly Singaporean fitness trainer speaking in Singlish. Your job is to collect user profile information and provide guidance.
-
-Required profile fields to collect:
-- age (integer, 1-120)
-- sex ("male" or "female") 
-- height_cm (float, 80-250)
-- weight_kg (float, 20-400)
-- activity_level ("sedentary", "light", "moderate", "active", "very_active")
-- first_meal (boolean - is this their first meal of the day?)
-
-Current profile: {json.dumps(current_profile)}
-Missing fields: {missing_fields}
-
-Guidelines:
-1. If this is the first interaction, give a warm greeting and explain what you do
-2. Ask for ONE missing field at a time in a conversational Singlish way
-3. Extract any profile information from the user's response
-4. If user mentions food, note it but continue profile collection first
-5. Be encouraging and friendly
-6. Try talking like a Singaporean, with a little bit of 'lah' and 'leh'
-
-Return JSON with:
-- "message": Your response to the user
-- "user_profile": Updated profile dict with any new info extracted
-- "profile_complete": true if all required fields are collected
-- "current_phase": "greeting" or "profile_collection"
-- "awaiting_user_input": true if you need more info from user
-- "food_request": copy any food mention from user input
-"""
-
-    user_prompt = f"""Conversation so far:
-{conversation_context}
+    # Validate and clean the profile data (null means "not mentioned")
+    extracted = {k: v for k, v in result["user_profile"].items() if v is not None}
+    cleaned_profile = _validate_profile_data(extracted)
+    result["user_profile"] = {**current_profile, **cleaned_profile}
+    
+    # Completion is decided by what was actually extracted
+    still_missing = _missing_fields(result["user_profile"])
+    result["profile_complete"] = not still_missing
+    result["awaiting_user_input"] = bool(still_missing)
+    
+    return result
 
-User just said: "{user_input}"
 
-Respond appropriately based on the conversation flow and profile collection needs."""
+def _fallback_profile_reply(current_profile: Dict[str, Any], missing_fields: List[str]) -> Dict[str, Any]:
+    """Fallback response: ask for everything still missing in one go."""
+    questions = " ".join(_FIELD_QUESTIONS[field] for field in missing_fields)
+    if not current_profile:
+        message = GREETING_TEMPLATE.format(questions=questions)
+    else:
+        message = questions or "Can you tell me more about yourself?"
+    
+    return {
+        "message": message,
+        "user_profile": current_profile,
+        "profile_complete": len(missing_fields) == 0,
+        "awaiting_user_input": True
+    }
+
 
-    try:
-        llm = ChatOpenAI(model="gpt-5-nano", temperature=1)
-        
-        response = llm.invoke([
-            SystemMessage(content=system_prompt),
-            HumanMessage(content=user_prompt)
-        ])
-        
-        result = json.loads(response.content)
-        
-        # Validate and clean the profile data
-        if "user_profile" in result:
-            cleaned_profile = _validate_profile_data(result["user_profile"])
-            result["user_profile"] = {**current_profile, **cleaned_profile}
-        
-        return result
-        
-    except Exception as e:
-        print(f"Error in trainer LLM call: {e}")
-        # Fallback response
-        if not current_profile:
-            return {
-                "message": "Hi there! I'm your fitness trainer lah! Let's see if you can eat that food. First, tell me your age?",
-                "user_profile": current_profile,
-                "profile_complete": False,
-                "current_phase": "profile_collection",
-                "awaiting_user_input": True
-            }
-        else:
-            next_field = missing_fields[0] if missing_fields else None
-            if next_field == "sex":
-                question = "Are you male or female?"
-            elif next_field == "height_cm":
-                question = "What's your height in cm?"
-            elif next_field == "weight_kg":
-                question = "What's your current weight in kg?"
-            elif next_field == "activity_level":
-                question = "How active are you? (sedentary/light/moderate/active/very_active)"
-            elif next_field == "first_meal":
-                question = "Is this your first meal of the day?"
-            else:
-                question = "Can you tell me more about yourself?"
-                
-            return {
-                "message": question,
-                "user_profile": current_profile,
-                "profile_complete": len(missing_fields) == 0,
-                "current_phase": "profile_collection",
-                "awaiting_user_input": True
-            }
-
-
-def _ask_for_food_request(state: State) -> Dict[str, Any]:
+def _greeting_reply() -> Dict[str, Any]:
+    """Templated opening reply, asking for every profile field."""
+    return {
+        "message": _GREETING_MESSAGE,
+        "awaiting_user_input": True
+    }
+
+
+def _missing_fields(profile: Dict[str, Any]) -> List[str]:
+    """Required profile fields not yet collected, in asking order."""
+    return [field for field in REQUIRED_FIELDS if field not in profile]
+
+
+def _extract_profile_heuristic(user_input: str) -> Tuple[Dict[str, Any], bool]:
+    """
+    Regex pass over the user's reply for unambiguous profile values.
+
+    Returns the validated fields found and whether nothing meaningful was left
+    over (i.e. the LLM would have nothing more to extract).
+    """
+    found: Dict[str, Any] = {}
+    for value, unit in _UNIT_RE.findall(user_input):
+        found[_UNIT_FIELDS[unit.lower().rstrip("s")]] = value
+    for word in _SEX_RE.findall(user_input):
+        found["sex"] = _SEX_WORDS[word.lower()]
+    for word in _ACTIVITY_RE.findall(user_input):
+        found["activity_level"] = word.lower().replace(" ", "_")
+    
+    remainder = _ACTIVITY_RE.sub(" ", _SEX_RE.sub(" ", _UNIT_RE.sub(" ", user_input)))
+    leftover = [w for w in re.findall(r"[a-z0-9']+", remainder.lower()) if w not in _FILLER_WORDS]
+    return _validate_profile_data(found), not leftover
+
+
+def _profile_progress_reply(profile: Dict[str, Any], missing_fields: List[str]) -> Dict[str, Any]:
+    """Templated reply once the heuristic has handled the user's input."""
+    if missing_fields:
+        questions = " ".join(_FIELD_QUESTIONS[field] for field in missing_fields)
+        message = f"Got it lah! {questions}"
+    else:
+        message = "Steady lah, got your full profile! Let me pass it to our nutritionist."
+    
+    return {
+        "message": message,
+        "user_profile": profile,
+        "profile_complete": not missing_fields,
+        "awaiting_user_input": bool(missing_fields)
+    }
+
+
+def _ask_for_food_request(nutrition_profile: Dict[str, Any]) -> Dict[str, Any]:
     """Ask user what food they want to analyze after nutrition profile is complete."""
     
-    nutrition_profile = state.get("nutrition_profile", {})
     target_calories = nutrition_profile.get("target_calories", 2000)
     
     return {
         "message": f"Perfect! Now I know your nutritional needs - you should aim for about {target_calories} calories per day for weight loss. What food would you like me to analyze for you? For example, you can ask about apples, bananas, cappuccino, toast, ham, or cheese!",
-        "awaiting_user_input": True,
-        "awaiting_food_request": True,
-        "current_phase": "food_request"
+        "awaiting_food_request": True
     }
 
 
-def _generate_final_recommendation(state: State) -> Dict[str, Any]:
-    """Generate final recommendation using all collected data."""
+async def _generate_final_recommendation(
+    profile_json: str, 
+    nutrition_profile: Dict[str, Any], 
+    food_analysis: Dict[str, Any], 
+    on_message_chunk: Optional[Callable[[str], None]] = None
+) -> Dict[str, Any]:
+    """Generate final recommendation using all collected data, streaming the message as it arrives."""
     
-    nutrition_profile = state.get("nutrition_profile", {})
-    food_analysis = state.get("food_analysis", {})
-    user_profile = state.get("user_profile", {})
-    
-    system_prompt = """You are a friendly Singaporean fitness trainer giving final food recommendations.
+    try:
+        # Partial JSON objects arrive as tokens stream in; "message" is the first field,
+        # so the user starts reading while the verdict is still being generated
+        partial: Dict[str, Any] = {}
+        shown = ""
+        async for partial in _final_recommendation_chain().astream(_final_inputs(profile_json, nutrition_profile, food_analysis)):
+            shown = _push_message_chunk(partial, shown, on_message_chunk)
+        return _parse_final_recommendation(partial, shown)
+        
+    except Exception as e:
+        log.warning("Error in final recommendation: %s", e)
+        return _fallback_final_recommendation(nutrition_profile, food_analysis)
 
-Analyze the user's profile, nutritional needs, and food choice to give a comprehensive recommendation.
 
-Consider:
-- Their BMI, BMR, TDEE, and target calories
-- The food's calories and nutritional content
-- Whether this fits their weight loss goals
-- Any health implications
-- Suggestions for balance
+def _final_inputs(profile_json: str, nutrition_profile: Dict[str, Any], food_analysis: Dict[str, Any]) -> Dict[str, Any]:
+    """Template variables for FINAL_PROMPT."""
+    return {
+        "profile_json": profile_json,
+        "nutrition_json": render_json(nutrition_profile),
+        "food_json": render_json(food_analysis),
+    }
 
-Respond in Singlish style with:
-- Clear verdict (can eat or should avoid)
-- Reasoning based on the data
-- Practical advice
-- Encouragement
 
-Return JSON with:
-- "message": Your final recommendation
-- "final_recommendation": Summary of your advice
-- "can_eat_verdict": true/false based on analysis
-"""
+def _push_message_chunk(
+    partial: Dict[str, Any], 
+    shown: str, 
+    on_message_chunk: Optional[Callable[[str], None]]
+) -> str:
+    """Send the not-yet-shown tail of the partial message to the callback; returns what is now shown."""
+    message = partial.get("message") or ""
+    if on_message_chunk and len(message) > len(shown):
+        on_message_chunk(message[len(shown):])
+        return message
+    return shown
 
-    user_prompt = f"""User Profile: {json.dumps(user_profile)}
-Nutrition Analysis: {json.dumps(nutrition_profile)}
-Food Analysis: {json.dumps(food_analysis)}
 
-Provide your final recommendation."""
+def _parse_final_recommendation(partial: Dict[str, Any], shown: str) -> Dict[str, Any]:
+    """Validate the fully streamed JSON object."""
+    result = FinalRecommendation.model_validate(partial).model_dump()
+    result["streamed"] = bool(shown)
+    return result
+
+
+def _fallback_final_recommendation(nutrition_profile: Dict[str, Any], food_analysis: Dict[str, Any]) -> Dict[str, Any]:
+    """Fallback recommendation from the calorie numbers alone."""
+    target_cals = nutrition_profile.get("target_calories", 2000)
+    food_cals = food_analysis.get("total_calories", 0)
+    can_eat = food_cals <= target_cals * 0.3  # Max 30% of daily calories in one meal
+    
+    return {
+        "message": f"Based on your target of {target_cals} calories per day, this food has {food_cals} calories. {'Can eat lah!' if can_eat else 'Better reduce a bit lor.'}",
+        "final_recommendation": f"Food analysis complete. {'Approved' if can_eat else 'Not recommended'} based on calorie targets.",
+        "can_eat_verdict": can_eat
+    }
 
-    try:
-        llm = ChatOpenAI(model="gpt-5-nano", temperature=1)
-        
-        response = llm.invoke([
-            SystemMessage(content=system_prompt),
-            HumanMessage(content=user_prompt)
-        ])
-        
-        result = json.loads(response.content)
-        return result
-        
-    except Exception as e:
-        print(f"Error in final recommendation: {e}")
-        # Fallback recommendation
-        target_cals = nutrition_profile.get("target_calories", 2000)
-        food_cals = food_analysis.get("total_calories", 0)
-        can_eat = food_cals <= target_cals * 0.3  # Max 30% of daily calories in one meal
-        
-        return {
-            "message": f"Based on your target of {target_cals} calories per day, this food has {food_cals} calories. {'Can eat lah!' if can_eat else 'Better reduce a bit lor.'}",
-            "final_recommendation": f"Food analysis complete. {'Approved' if can_eat else 'Not recommended'} based on calorie targets.",
-            "can_eat_verdict": can_eat
-        }
+
+@lru_cache(maxsize=None)
+def _profile_chain() -> Runnable:
+    """Profile-collection prompt piped into the fast extraction model."""
+    llm = get_structured_llm(TrainerResponse, PROFILE_MODEL, temperature=0, max_tokens=PROFILE_MAX_TOKENS)
+    return PROFILE_PROMPT | llm
+
+
+@lru_cache(maxsize=None)
+def _final_recommendation_chain() -> Runnable:
+    """Streaming final-recommendation chain emitting progressively parsed JSON."""
+    llm = get_llm().bind(response_format=strict_response_format(FinalRecommendation))
+    return FINAL_PROMPT | llm | JsonOutputParser()
 
 
 def _validate_profile_data(profile_data: Dict[str, Any]) -> Dict[str, Any]:
     """Validate and clean profile data."""
     cleaned = {}
     
-    if "age" in profile_data:
-        try:
-            age = int(profile_data["age"])
-            if 1 <= age <= 120:
-                cleaned["age"] = age
-        except (ValueError, TypeError):
-            pass
-    
-    if "sex" in profile_data:
-        sex = str(profile_data["sex"]).lower()
-        if sex in ["male", "female"]:
-            cleaned["sex"] = sex
-    
-    if "height_cm" in profile_data:
-        try:
-            height = float(profile_data["height_cm"])
-            if 80 <= height <= 250:
-                cleaned["height_cm"] = height
-        except (ValueError, TypeError):
-            pass
-    
-    if "weight_kg" in profile_data:
-        try:
-            weight = float(profile_data["weight_kg"])
-            if 20 <= weight <= 400:
-                cleaned["weight_kg"] = weight
-        except (ValueError, TypeError):
-            pass
+    for key, (cast, low, high) in _RANGE_VALIDATORS.items():
+        if key in profile_data:
+            try:
+                value = cast(profile_data[key])
+            except (ValueError, TypeError):
+                continue
+            if low <= value <= high:
+                cleaned[key] = value
     
-    if "activity_level" in profile_data:
-        activity = str(profile_data["activity_level"]).lower()
-        valid_levels = ["sedentary", "light", "moderate", "active", "very_active"]
-        if activity in valid_levels:
-            cleaned["activity_level"] = activity
+    for key, allowed in _ENUM_VALIDATORS.items():
+        if key in profile_data:
+            value = str(profile_data[key]).lower()
+            if value in allowed:
+                cleaned[key] = value
     
     if "first_meal" in profile_data:
-        if isinstance(profile_data["first_meal"], bool):
-            cleaned["first_meal"] = profile_data["first_meal"]
-        else:
+        first_meal = profile_data["first_meal"]
+        if not isinstance(first_meal, bool):
             # Try to parse from string
-            first_meal_str = str(profile_data["first_meal"]).lower()
-            if first_meal_str in ["true", "yes", "y", "first"]:
-                cleaned["first_meal"] = True
-            elif first_meal_str in ["false", "no", "n", "not first"]:
-                cleaned["first_meal"] = False
+            first_meal = str(first_meal).lower()
+        if first_meal in _TRUE_VALUES:
+            cleaned["first_meal"] = True
+        elif first_meal in _FALSE_VALUES:
+            cleaned["first_meal"] = False
     
     return cleaned
@@ -1,6 +1,16 @@
+import asyncio
+import logging
+import os
+import sys
+from typing import Any, Dict, Iterable, List, Optional, Union
+import aiosqlite
 from dotenv import load_dotenv
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
 from langgraph.graph import StateGraph, START, END
 
+from agents import configure_llm_cache
 from state import State
 from nodes import (
     human_node,
@@ -9,16 +19,84 @@ from nodes import (
     trainer_node,
     nutritionist_node,
     food_specialist_node,
+    join_node,
     completion_node
 )
 
 # Load environment variables
 load_dotenv(override=True)
 
+# Agent and routing debug logs stay off unless LOG_LEVEL=DEBUG
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "WARNING").upper())
 
-def build_graph():
+# Sessions are checkpointed here after every step, per CANEATNOT_USER, so they can be resumed
+CHECKPOINT_PATH = ".caneatnot.db"
+# State.messages holds state.Message dataclasses, which the serializer only restores when allowed
+_CHECKPOINT_SERDE = JsonPlusSerializer(allowed_msgpack_modules=[("state", "Message")])
+
+# Console labels for log entries, keyed by the role that wrote them
+_LOG_LABELS = {
+    "trainer": "Trainer 🧑‍🏫",
+    "nutritionist": "Nutritionist 🥼",
+    "food_specialist": "Food Specialist 🍎",
+}
+
+
+# Conditional-edge path maps, shared by every build_graph() call
+_TRAINER_EDGES = {
+    "human": "human",
+    "nutritionist": "nutritionist",
+    "food_specialist": "food_specialist",
+    "trainer": "trainer",
+    "completion": "completion"
+}
+_HUMAN_EDGES = {
+    "complete": "completion",
+    "continue": "trainer"  # Always go to trainer first to handle input
+}
+_NUTRITIONIST_EDGES = {
+    "trainer": "trainer",
+    "food_specialist": "food_specialist",
+    "join": "join",
+    "human": "human"
+}
+_FOOD_SPECIALIST_EDGES = {
+    "trainer": "trainer",
+    "join": "join",
+    "human": "human"
+}
+_JOIN_EDGES = {
+    "trainer": "trainer",
+    "human": "human"
+}
+
+
+def after_nutritionist(state: State) -> Union[str, List[str]]:
+    """
+    From nutritionist, determine next step.
+
+    Alongside the food specialist it leaves the phase at "nutrition" and waits at the join.
+    """
+    if state.get("current_phase") == "nutrition":
+        return "join"
+    return determine_next_agent(state)
+
+
+def after_food_specialist(state: State) -> Union[str, List[str]]:
+    """
+    From food specialist, determine next step (alongside the nutritionist it waits at the join).
+    """
+    if state.get("current_phase") == "nutrition":
+        return "join"
+    return determine_next_agent(state)
+
+
+def build_graph(checkpointer: Optional[BaseCheckpointSaver] = None):
     """
     Build the Can-Eat-Not LangGraph workflow.
+
+    A graph is bound to its checkpointer, so one is built per saver. Agent results
+    are cached inside the agents, which outlive any one graph.
     """
     builder = StateGraph(State)
     
@@ -27,87 +105,50 @@ def build_graph():
     builder.add_node("trainer", trainer_node)
     builder.add_node("nutritionist", nutritionist_node)
     builder.add_node("food_specialist", food_specialist_node)
+    builder.add_node("join", join_node)
     builder.add_node("completion", completion_node)
     
     # Start with trainer for greeting
     builder.add_edge(START, "trainer")
     
-    # From trainer, check if we need user input or can continue
-    def after_trainer(state: State):
-        if state.get("session_complete", False):
-            return "completion"
-        if state.get("awaiting_user_input", False):
-            return "human"
-        # Determine next agent based on state
-        next_agent = determine_next_agent(state)
-        return next_agent
-    
-    builder.add_conditional_edges(
-        "trainer", 
-        after_trainer, 
-        {
-            "human": "human",
-            "nutritionist": "nutritionist", 
-            "food_specialist": "food_specialist",
-            "trainer": "trainer",
-            "completion": "completion"
-        }
-    )
-    
-    # From human input, check session status
-    builder.add_conditional_edges(
-        "human",
-        check_session_status,
-        {
-            "complete": "completion",
-            "continue": "trainer"  # Always go to trainer first to handle input
-        }
-    )
-    
-    # From nutritionist, determine next step
-    def after_nutritionist(state: State):
-        return determine_next_agent(state)
-    
-    builder.add_conditional_edges(
-        "nutritionist",
-        after_nutritionist,
-        {
-            "trainer": "trainer",
-            "food_specialist": "food_specialist",
-            "human": "human"
-        }
-    )
-    
-    # From food specialist, determine next step
-    def after_food_specialist(state: State):
-        return determine_next_agent(state)
-    
-    builder.add_conditional_edges(
-        "food_specialist",
-        after_food_specialist,
-        {
-            "trainer": "trainer",
-            "human": "human"
-        }
-    )
+    # From trainer: the phase it wrote says whether to wait for the user, hand over, or finish
+    builder.add_conditional_edges("trainer", determine_next_agent, _TRAINER_EDGES)
+    builder.add_conditional_edges("human", check_session_status, _HUMAN_EDGES)
+    builder.add_conditional_edges("nutritionist", after_nutritionist, _NUTRITIONIST_EDGES)
+    builder.add_conditional_edges("food_specialist", after_food_specialist, _FOOD_SPECIALIST_EDGES)
+    # Both parallel branches done, determine next step
+    builder.add_conditional_edges("join", determine_next_agent, _JOIN_EDGES)
     
     # Completion node ends the flow
     builder.add_edge("completion", END)
     
-    return builder.compile()
+    return builder.compile(checkpointer=checkpointer)
 
 
-def main():
+async def amain():
     """
-    Main function to run the Can-Eat-Not application.
+    Run the Can-Eat-Not application on the event loop.
     """
+    configure_llm_cache()
+    
     print("=== CAN-EAT-NOT: Multi-Agent Nutrition Assistant ===")
     print("🧑‍🏫 Trainer | 🥼 Nutritionist | 🍎 Food Specialist")
     print("Type 'exit', 'quit', or ':q' to end the session.\n")
     print("Let's help you make healthy food choices! 🌟\n")
     
-    # Build the graph
-    graph = build_graph()
+    async with aiosqlite.connect(CHECKPOINT_PATH) as conn:
+        checkpointer = AsyncSqliteSaver(conn, serde=_CHECKPOINT_SERDE)
+        await _run_session(build_graph(checkpointer), checkpointer, os.getenv("CANEATNOT_USER", "default"))
+
+
+async def _run_session(graph, checkpointer: BaseCheckpointSaver, thread_id: str) -> None:
+    """
+    Resume thread_id's saved session if it was interrupted, otherwise start a fresh one.
+
+    Only Ctrl-C (or a killed process) leaves a thread to resume; a session that failed
+    is deleted, so the next launch does not replay the failure.
+    """
+    config = {"configurable": {"thread_id": thread_id}}
     
     # Uncomment to see the graph structure
     # print("Graph structure:")
@@ -117,17 +158,16 @@ def main():
     # Initialize state
     initial_state = State(
         messages=[],
+        log=[],
         current_user_input="",
-        awaiting_user_input=False,
         user_profile={},
         profile_complete=False,
+        profile_json="",
         nutrition_profile={},
+        wants_detailed_analysis=False,
         food_analysis={},
         current_phase="greeting",
-        next_agent="trainer",
         food_request=None,
-        food_request_pending=False,
-        awaiting_food_request=False,
         final_recommendation="",
         can_eat_verdict=False,
         session_complete=False
@@ -135,7 +175,35 @@ def main():
     
     try:
         # Run the graph
-        final_state = graph.invoke(initial_state)
+        snapshot = await graph.aget_state(config)
+        if snapshot.next:
+            print("Picking up your saved session where it stopped...")
+            # Show the question the user was answering before the prompt comes back
+            last_trainer = next((m for m in reversed(snapshot.values["messages"]) if m.role == "trainer"), None)
+            if last_trainer is not None:
+                sys.stdout.write(_render_log([{"role": "trainer", "content": last_trainer.content}]))
+            inputs = None
+        else:
+            # A finished session would otherwise leak into the new one through the append reducers
+            await checkpointer.adelete_thread(thread_id)
+            inputs = initial_state
+        
+        # Nodes never print; their console output arrives here as stream events
+        async for mode, payload in graph.astream(inputs, config, stream_mode=["custom", "updates"]):
+            if mode == "custom":
+                # Status lines and streamed tokens, shown as they arrive
+                sys.stdout.write(payload)
+                sys.stdout.flush()
+            else:
+                rendered = _render_log(
+                    entry
+                    for update in payload.values() if isinstance(update, dict)
+                    for entry in update.get("log", ())
+                )
+                if rendered:
+                    # input() flushes stdout before prompting, so this is written once per turn
+                    sys.stdout.write(rendered)
+        final_state = (await graph.aget_state(config)).values
         
         # Print final summary if available
         if final_state.get("final_recommendation"):
@@ -147,12 +215,37 @@ def main():
             print(f"Verdict: {verdict}")
             print(f"{'='*50}")
         
-    except KeyboardInterrupt:
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        # asyncio.run() delivers Ctrl-C as a cancellation of this task; progress is already checkpointed
         print("\n\n⚠️ Session interrupted by user. Stay healthy! 👋")
     except Exception as e:
+        # Resuming would hit the same error again, so the next launch starts fresh
+        await checkpointer.adelete_thread(thread_id)
         print(f"\n❌ An error occurred: {e}")
         print("Session ended. Please try again later.")
 
 
+def _render_log(entries: Iterable[Dict[str, Any]]) -> str:
+    """
+    Format a node's log entries for the console, skipping messages already streamed.
+    """
+    return "".join(
+        f"\n{_LOG_LABELS[entry['role']]}: {entry['content']}\n" if entry["role"] in _LOG_LABELS
+        else f"\n{entry['content']}\n"
+        for entry in entries
+        if not entry.get("streamed")
+    )
+
+
+def main():
+    """
+    Main function to run the Can-Eat-Not application.
+    """
+    try:
+        asyncio.run(amain())
+    except KeyboardInterrupt:
+        print("\n\n⚠️ Session interrupted by user. Stay healthy! 👋")
+
+
 if __name__ == "__main__":
     main()
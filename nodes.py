@@ -1,146 +1,274 @@
-from typing import Literal
-from datetime import datetime
-from state import State, Message
-from agents import trainer, nutritionist, food_specialist
+import asyncio
+import logging
+import re
+import threading
+from functools import lru_cache
+from typing import Dict, Iterable, List, Literal, Optional, Tuple, Union
+import ahocorasick
+from langgraph.types import StreamWriter
+from state import State, Message, Phase
+from agents import trainer_async, nutritionist_async, food_specialist_async
 
+log = logging.getLogger(__name__)
 
-def human_node(state: State) -> dict:
+# Requests that warrant the nutritionist's full LLM analysis instead of the quick assessment
+DETAILED_ANALYSIS_KEYWORDS = [
+    "meal plan", "diet plan", "nutrition plan", "what should i eat", "meal ideas", "diet advice",
+    "in detail", "more detail", "detailed", "explain", "tell me more"
+]
+
+CONSUMPTION_PHRASES = frozenset({
+    "i want to eat", "can i eat", "i'm eating", "eating", "i'll eat", "let me eat",
+    "should i eat", "is it ok to eat", "can eat", "want to eat"
+})
+SPECIFIC_FOODS = frozenset({"apple", "banana", "toast", "cappuccino", "cheese", "ham", "kfc", "pizza", "burger", "chicken"})
+QUANTITY_WORDS = frozenset({"1", "2", "3", "4", "5", "one", "two", "three"})
+
+
+def _alternation(words: Iterable[str]) -> str:
+    """Regex alternation matching any of the words literally."""
+    return "|".join(map(re.escape, sorted(words)))
+
+
+def _automaton(words: Iterable[str]) -> ahocorasick.Automaton:
+    """Aho-Corasick automaton over words, each stored with its length."""
+    automaton = ahocorasick.Automaton()
+    for word in words:
+        automaton.add_word(word, len(word))
+    automaton.make_automaton()
+    return automaton
+
+
+def _has_word_start_match(automaton: ahocorasick.Automaton, text: str) -> bool:
+    """True if any of the automaton's words occurs in text starting at a word start (like a leading \\b)."""
+    for end, length in automaton.iter(text):
+        start = end - length + 1
+        if start == 0 or not (text[start - 1].isalnum() or text[start - 1] == "_"):
+            return True
+    return False
+
+
+# One pass over the input per vocabulary, however many terms it holds. Matches are
+# anchored at a word start only, so "2 apples" still matches as it did with the
+# old substring tests.
+CONSUMPTION_AUTOMATON = _automaton(CONSUMPTION_PHRASES)
+FOOD_AUTOMATON = _automaton(SPECIFIC_FOODS)
+DETAILED_ANALYSIS_RE = re.compile(rf"\b(?:{_alternation(DETAILED_ANALYSIS_KEYWORDS)})")
+QTY_FOOD_RE = re.compile(rf"\b(?:{_alternation(QUANTITY_WORDS)})\s+(?:{_alternation(SPECIFIC_FOODS)})")
+
+# Fixed sign-off written by completion_node
+FAREWELL_LOG = (
+    {"role": "system", "content": "=== SESSION COMPLETE ==="},
+    {"role": "system", "content": "Thank you for using Can-Eat-Not! Stay healthy! 🌟"},
+)
+
+# Node that handles each phase
+PHASE_ROUTES: Dict[Phase, str] = {
+    "greeting": "trainer",
+    "collecting_profile": "trainer",
+    "awaiting_user": "human",
+    "nutrition": "nutritionist",
+    "awaiting_food": "human",
+    "food_analysis": "food_specialist",
+    "recommend": "trainer",
+    "complete": "completion",
+}
+
+# Independent once the profile is complete, so both run in the same super-step
+ANALYSIS_FAN_OUT: Tuple[str, ...] = ("nutritionist", "food_specialist")
+
+
+async def human_node(state: State) -> dict:
     """
     Human input node - gets user input and updates conversation state.
     """
-    user_input = input("\nYou: ").strip()
+    user_input = (await _read_line("\nYou: ")).strip()
     
     # Check for exit conditions
     if user_input.lower() in {"exit", "quit", ":q", "bye"}:
         return {
             "current_user_input": user_input,
             "session_complete": True,
-            "awaiting_user_input": False
+            "current_phase": "complete"
         }
     
-    # Add user message to conversation
-    messages = state.get("messages", []).copy()
-    messages.append(Message(
+    # Add user message to conversation (the messages reducer appends it)
+    messages = [Message(
         role="user",
-        content=user_input,
-        timestamp=datetime.now().isoformat()
-    ))
+        content=user_input
+    )]
     
     # Check if this looks like a specific food consumption request (not general meal planning)
     # Only trigger food specialist for specific food items the user wants to eat
-    consumption_phrases = [
-        "i want to eat", "can i eat", "i'm eating", "eating", "i'll eat", "let me eat",
-        "should i eat", "is it ok to eat", "can eat", "want to eat"
-    ]
-    specific_foods = ["apple", "banana", "toast", "cappuccino", "cheese", "ham", "kfc", "pizza", "burger", "chicken"]
-    
     user_lower = user_input.lower()
     
-    # Check if user is asking about eating something specific
-    has_consumption_intent = any(phrase in user_lower for phrase in consumption_phrases)
-    has_specific_food = any(food in user_lower for food in specific_foods)
+    # Meal planning or "explain in detail" requests go to the nutritionist's full LLM analysis
+    wants_detailed_analysis = bool(DETAILED_ANALYSIS_RE.search(user_lower))
     
     # Only set as food request if both consumption intent AND specific food are present
     # OR if it's a clear food item with quantity (e.g., "2 apples", "kfc meal")
-    is_food_request = (has_consumption_intent and has_specific_food) or \
-                     any(f"{num} {food}" in user_lower for num in ["1", "2", "3", "4", "5", "one", "two", "three"] for food in specific_foods)
+    is_food_request = (_has_word_start_match(CONSUMPTION_AUTOMATON, user_lower) and
+                       _has_word_start_match(FOOD_AUTOMATON, user_lower)) or \
+                     bool(QTY_FOOD_RE.search(user_lower))
     
     return {
         "messages": messages,
         "current_user_input": user_input,
-        "awaiting_user_input": False,
-        "food_request": user_input if is_food_request and not state.get("food_request") else state.get("food_request"),
-        "food_request_pending": is_food_request and state.get("profile_complete", False)
+        "food_request": user_input if is_food_request and not state["food_request"] else state["food_request"],
+        "wants_detailed_analysis": wants_detailed_analysis
     }
 
 
+async def _read_line(prompt: str) -> str:
+    """
+    input() on a daemon thread, so the event loop keeps running while the user types.
+
+    Not asyncio.to_thread(): on Ctrl-C asyncio.run() waits for its executor threads, and the
+    one blocked in input() would hold the process open until Enter is pressed.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    
+    def settle(result: str, error: Optional[BaseException]) -> None:
+        if future.done():  # Cancelled while the user was typing
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+    
+    def read() -> None:
+        try:
+            line, error = input(prompt), None
+        except BaseException as e:  # EOFError when stdin closes
+            line, error = "", e
+        try:
+            loop.call_soon_threadsafe(settle, line, error)
+        except RuntimeError:
+            pass  # Loop already closed; nobody is waiting for the line
+    
+    threading.Thread(target=read, name="stdin-reader", daemon=True).start()
+    return await future
+
+
 def check_session_status(state: State) -> Literal["complete", "continue"]:
     """
     Check if session should end or continue.
     """
-    if state.get("session_complete", False):
+    if state["session_complete"]:
         return "complete"
     return "continue"
 
 
-def determine_next_agent(state: State) -> Literal["trainer", "nutritionist", "food_specialist", "human"]:
+def determine_next_agent(state: State) -> Union[str, List[str]]:
     """
-    Determine which agent should handle the next step based on current state.
+    Determine which node handles the next step: the phase written by the last node names it.
     """
-    current_phase = state.get("current_phase", "greeting")
-    profile_complete = state.get("profile_complete", False)
-    food_request = state.get("food_request")
-    has_nutrition_profile = bool(state.get("nutrition_profile"))
-    has_food_analysis = bool(state.get("food_analysis"))
-    awaiting_food_request = state.get("awaiting_food_request", False)
-    user_input = state.get("current_user_input", "").lower()
-    
-    print(f"🔄 Routing - Profile: {profile_complete}, Nutrition: {has_nutrition_profile}, Food Request: {bool(food_request)}, Food Analysis: {has_food_analysis}, Awaiting Food: {awaiting_food_request}")
-    
+    phase = state["current_phase"]
+    # A nutrition phase with a food request already waiting fans out to both agents
+    if phase == "nutrition" and _in_fan_out(state):
+        return list(ANALYSIS_FAN_OUT)
+    return PHASE_ROUTES[phase]
+
+
+def next_phase(state: State) -> Phase:
+    """
+    Phase that follows once state holds a node's writes.
+    """
+    key = (
+        bool(state["profile_complete"]),
+        bool(state["food_request"]),
+        bool(state["nutrition_profile"]),
+        bool(state["food_analysis"]),
+        bool(state["final_recommendation"]),
+        bool(state["wants_detailed_analysis"]),
+    )
+    log.debug("Routing - Profile: %s, Food Request: %s, Nutrition: %s, Food Analysis: %s, "
+              "Final: %s, Detailed: %s", *key)
+    return _next_phase(*key)
+
+
+@lru_cache(maxsize=None)
+def _next_phase(
+    profile_complete: bool,
+    food_request: bool,
+    has_nutrition_profile: bool,
+    has_food_analysis: bool,
+    final_recommendation: bool,
+    wants_detailed_analysis: bool,
+) -> Phase:
+    """Next phase for one combination of state flags (at most 64, so all are cached)."""
     # Step 1: If profile not complete, collect it with trainer
     if not profile_complete:
-        return "trainer"
+        return "collecting_profile"
     
     # Step 2: If profile complete but no nutrition analysis, do nutrition analysis
+    # (together with the food analysis when the user already named a food)
     if profile_complete and not has_nutrition_profile:
-        return "nutritionist"
+        return "nutrition"
     
-    # Step 3: Check if user is asking for meal planning/nutrition advice (not specific food)
-    meal_planning_keywords = ["meal plan", "diet plan", "nutrition plan", "what should i eat", "meal ideas", "diet advice"]
-    is_meal_planning_request = any(keyword in user_input for keyword in meal_planning_keywords)
-    
-    if profile_complete and has_nutrition_profile and is_meal_planning_request:
-        return "nutritionist"  # Route to nutritionist for meal planning
+    # Step 3: Check if user asked for meal planning/detailed nutrition advice (not specific food)
+    if profile_complete and has_nutrition_profile and wants_detailed_analysis:
+        return "nutrition"  # Route to nutritionist for meal planning
     
     # Step 4: After nutrition analysis, trainer should ask for specific food to analyze
-    if profile_complete and has_nutrition_profile and not food_request and not awaiting_food_request:
-        return "trainer"  # Trainer asks for specific food
+    if profile_complete and has_nutrition_profile and not food_request:
+        return "recommend"  # Trainer asks for specific food
     
     # Step 5: If we have specific food request but no food analysis, analyze food
     if food_request and not has_food_analysis:
-        return "food_specialist"
+        return "food_analysis"
     
     # Step 6: If we have everything, make final recommendation
     if (profile_complete and has_nutrition_profile and has_food_analysis and 
-        not state.get("final_recommendation")):
-        return "trainer"  # Trainer gives final recommendation
+        not final_recommendation):
+        return "recommend"  # Trainer gives final recommendation
     
     # Default back to human for more input
-    return "human"
+    return "awaiting_user"
 
 
-def trainer_node(state: State) -> dict:
+async def trainer_node(state: State, writer: StreamWriter) -> dict:
     """
     Trainer node - handles profile collection and final recommendations.
     """
-    print("\n🧑‍🏫 Trainer is thinking...")
+    writer("\n🧑‍🏫 Trainer is thinking...\n")
+    
+    streaming = False
+    
+    def stream_to_console(chunk: str) -> None:
+        nonlocal streaming
+        if not streaming:
+            writer("\nTrainer 🧑‍🏫: ")
+            streaming = True
+        writer(chunk)
     
-    result = trainer(state)
+    result = await trainer_async(state, on_message_chunk=stream_to_console)
+    if streaming:
+        writer("\n")
     
     # Add trainer message to conversation
-    messages = state.get("messages", []).copy()
+    messages = []
+    log_entries = []
     if result.get("message"):
         messages.append(Message(
             role="trainer",
-            content=result["message"],
-            timestamp=datetime.now().isoformat()
+            content=result["message"]
         ))
-        print(f"\nTrainer 🧑‍🏫: {result['message']}")
+        log_entries.append({"role": "trainer", "content": result["message"], "streamed": bool(result.get("streamed"))})
     
     # Update state based on trainer's response
     updates = {
         "messages": messages,
-        "awaiting_user_input": result.get("awaiting_user_input", False)
+        "log": log_entries
     }
     
     # Update profile if provided
     if result.get("user_profile"):
         updates["user_profile"] = result["user_profile"]
         updates["profile_complete"] = result.get("profile_complete", False)
-    
-    # Update phase if provided
-    if result.get("current_phase"):
-        updates["current_phase"] = result["current_phase"]
+    if result.get("profile_json"):
+        updates["profile_json"] = result["profile_json"]
     
     # Update final recommendation if provided
     if result.get("final_recommendation"):
@@ -148,70 +276,96 @@ def trainer_node(state: State) -> dict:
         updates["can_eat_verdict"] = result.get("can_eat_verdict", False)
         updates["session_complete"] = True
     
+    # Waiting on the user, or hand over to whichever agent the new state calls for
+    if updates.get("session_complete"):
+        updates["current_phase"] = "complete"
+    elif result.get("awaiting_food_request"):
+        updates["current_phase"] = "awaiting_food"
+    elif result.get("awaiting_user_input"):
+        updates["current_phase"] = "awaiting_user"
+    else:
+        updates["current_phase"] = next_phase({**state, **updates})
+    
     return updates
 
 
-def nutritionist_node(state: State) -> dict:
+async def nutritionist_node(state: State, writer: StreamWriter) -> dict:
     """
     Nutritionist node - analyzes user profile and provides nutritional assessment.
     """
-    print("\n🥼 Nutritionist is analyzing your profile...")
+    writer("\n🥼 Nutritionist is analyzing your profile...\n")
     
-    result = nutritionist(state)
+    result = await nutritionist_async(state)
     
     # Add nutritionist message to conversation
-    messages = state.get("messages", []).copy()
+    messages = []
+    log_entries = []
     if result.get("message"):
         messages.append(Message(
             role="nutritionist",
-            content=result["message"],
-            timestamp=datetime.now().isoformat()
+            content=result["message"]
         ))
-        print(f"\nNutritionist 🥼: {result['message']}")
+        log_entries.append({"role": "nutritionist", "content": result["message"]})
     
-    return {
+    updates = {
         "messages": messages,
-        "nutrition_profile": result.get("nutrition_profile", state.get("nutrition_profile", {})),
-        "current_phase": "nutrition_analysis",
-        "awaiting_user_input": False
+        "log": log_entries,
+        "nutrition_profile": result.get("nutrition_profile", state["nutrition_profile"]),
+        "wants_detailed_analysis": False
     }
+    # Alongside the food specialist, the join node sets the phase from both results
+    if not _in_fan_out(state):
+        updates["current_phase"] = next_phase({**state, **updates})
+    return updates
 
 
-def food_specialist_node(state: State) -> dict:
+async def food_specialist_node(state: State, writer: StreamWriter) -> dict:
     """
     Food specialist node - analyzes requested food and provides nutritional information.
     """
-    print("\n🍎 Food Specialist is analyzing your food...")
+    writer("\n🍎 Food Specialist is analyzing your food...\n")
     
-    result = food_specialist(state)
+    result = await food_specialist_async(state)
     
     # Add food specialist message to conversation
-    messages = state.get("messages", []).copy()
+    messages = []
+    log_entries = []
     if result.get("message"):
         messages.append(Message(
             role="food_specialist",
-            content=result["message"],
-            timestamp=datetime.now().isoformat()
+            content=result["message"]
         ))
-        print(f"\nFood Specialist 🍎: {result['message']}")
+        log_entries.append({"role": "food_specialist", "content": result["message"]})
     
-    return {
+    updates = {
         "messages": messages,
-        "food_analysis": result.get("food_analysis", state.get("food_analysis", {})),
-        "current_phase": "food_analysis",
-        "food_request_pending": False,
-        "awaiting_user_input": False
+        "log": log_entries,
+        "food_analysis": result.get("food_analysis", state["food_analysis"])
     }
+    # Alongside the nutritionist, the join node sets the phase from both results
+    if not _in_fan_out(state):
+        updates["current_phase"] = next_phase({**state, **updates})
+    return updates
+
 
+def _in_fan_out(state: State) -> bool:
+    """True for the input state of the parallel nutritionist + food specialist step (see ANALYSIS_FAN_OUT)."""
+    return bool(state["food_request"]) and not state["food_analysis"] and not state["nutrition_profile"]
 
-def completion_node(state: State) -> dict:
+
+async def join_node(state: State) -> dict:
+    """
+    Join node - runs once both parallel branches (nutritionist and food specialist) have written.
+    """
+    return {"current_phase": next_phase(state)}
+
+
+async def completion_node(state: State) -> dict:
     """
     Completion node - handles session end.
     """
-    print("\n=== SESSION COMPLETE ===")
-    print("\nThank you for using Can-Eat-Not! Stay healthy! 🌟")
-    
     return {
+        "log": list(FAREWELL_LOG),
         "session_complete": True,
-        "awaiting_user_input": False
+        "current_phase": "complete"
     }
@@ -1,11 +1,20 @@
-from typing import TypedDict, List, Dict, Any, Optional, Literal
+import operator
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Annotated, TypedDict, List, Dict, Any, Optional, Literal
 
 
-class Message(TypedDict):
-    """Individual message in conversation"""
+@dataclass(slots=True, frozen=True)
+class Message:
+    """Individual message in conversation (slotted; orjson and the LangGraph serializer handle dataclasses)"""
     role: Literal["user", "trainer", "nutritionist", "food_specialist"]
     content: str
-    timestamp: Optional[str]
+    ts_ns: int = field(default_factory=time.time_ns)  # Wall-clock nanoseconds; see iso()
+
+    def iso(self) -> str:
+        """Timestamp as an ISO 8601 string, formatted only when displayed."""
+        return datetime.fromtimestamp(self.ts_ns / 1e9).isoformat()
 
 
 class UserProfile(TypedDict, total=False):
@@ -42,31 +51,48 @@ class FoodAnalysis(TypedDict, total=False):
     health_impact: str
 
 
+def merge_dicts(current: Dict[str, Any], update: Dict[str, Any]) -> Dict[str, Any]:
+    """Reducer for agent outputs written from parallel branches: update wins key by key."""
+    return {**current, **update}
+
+
+# What the workflow does next; each node writes the phase that follows it
+Phase = Literal[
+    "greeting",            # trainer greets and starts collecting the profile
+    "collecting_profile",  # trainer continues collecting the profile
+    "awaiting_user",       # waiting for the user's reply
+    "nutrition",           # nutritionist analyzes the profile
+    "awaiting_food",       # waiting for the user to name a food
+    "food_analysis",       # food specialist analyzes the requested food
+    "recommend",           # trainer asks for a food or gives the verdict
+    "complete",            # session over
+]
+
+
 class State(TypedDict):
     """
     Overall state of the Can-Eat-Not LangGraph system.
     """
     # Conversation management
-    messages: List[Message]
+    messages: Annotated[List[Message], operator.add]  # Nodes return only their new messages
+    log: Annotated[List[Dict[str, Any]], operator.add]  # Console output ({"role", "content"}), written out by main
     current_user_input: str
-    awaiting_user_input: bool
     
     # User data
     user_profile: UserProfile
     profile_complete: bool
+    profile_json: str  # user_profile rendered for prompts once complete
     
     # Agent outputs
-    nutrition_profile: NutritionProfile
-    food_analysis: FoodAnalysis
+    nutrition_profile: Annotated[NutritionProfile, merge_dicts]
+    wants_detailed_analysis: bool  # User asked for the nutritionist's full LLM analysis
+    food_analysis: Annotated[FoodAnalysis, merge_dicts]  # Whole request (summed when several foods were named)
     
     # Flow control
-    current_phase: Literal["greeting", "profile_collection", "nutrition_analysis", "food_analysis", "recommendation", "complete"]
-    next_agent: Literal["trainer", "nutritionist", "food_specialist", "human"]
+    current_phase: Phase
     
     # Food request tracking
-    food_request: Optional[str]
-    food_request_pending: bool
-    awaiting_food_request: bool
+    food_request: Optional[str]  # The user message naming the food(s); the food specialist picks out the items
     
     # Final recommendation
     final_recommendation: str
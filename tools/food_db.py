@@ -1,42 +1,75 @@
 from __future__ import annotations
-import json, re
+import mmap, re
+from array import array
+from functools import cached_property
+import orjson
 from pathlib import Path
-from typing import Dict, Any, Optional, Tuple
+from typing import Dict, Any, List, Optional, Tuple
+
+# "<qty> <food>" on already-stripped text
+_QTY_RE = re.compile(r"\A(\d+)\s+([\w\s\-]+)\Z", re.I)
 
 class FoodDB:
     def __init__(self, path: Path):
+        # Parsed and indexed on first lookup, so sessions that never ask about food skip the load
         self.path = Path(path)
-        self.data = self._load()
+
+    @cached_property
+    def data(self) -> Dict[str, Any]:
+        return self._load()
+
+    @cached_property
+    def _index(self) -> Tuple[Dict[str, Dict[str, Any]], List[str], List[Dict[str, Any]], array]:
+        by_exact, names, name_items = self._build_index()
+        return by_exact, names, name_items, array("i", map(len, names))
 
     def _load(self) -> Dict[str, Any]:
-        raw = self.path.read_text(encoding="utf-8")
-        try:
-            return json.loads(raw)
-        except json.JSONDecodeError:
-            return json.loads(raw.strip())
+        # Parse straight from the mapped file; no decoded str copy of the whole DB
+        with self.path.open("rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            with memoryview(mm) as raw:
+                try:
+                    return orjson.loads(raw)
+                except orjson.JSONDecodeError:
+                    return orjson.loads(bytes(raw).strip())
 
     def _items(self):
         return self.data.get("food_response", [])
 
-    def find_match(self, name: str) -> Optional[Dict[str, Any]]:
-        name_l = name.lower()
+    def _build_index(self) -> Tuple[Dict[str, Dict[str, Any]], List[str], List[Dict[str, Any]]]:
+        # Lowercased names, once: exact name -> first item, plus parallel name/item arrays in DB order
+        by_exact: Dict[str, Dict[str, Any]] = {}
+        names: List[str] = []
+        name_items: List[Dict[str, Any]] = []
         for item in self._items():
-            entry = (item.get("food_entry_name") or "").lower()
-            if entry == name_l or name_l in entry or entry in name_l:
-                return item
             eaten = item.get("eaten", {})
-            for k in ("food_name_singular","food_name_plural"):
-                v = (eaten.get(k) or "").lower()
-                if v and (v == name_l or name_l in v or v in name_l):
-                    return item
+            for v in (item.get("food_entry_name"), eaten.get("food_name_singular"), eaten.get("food_name_plural")):
+                v = (v or "").lower()
+                if v:
+                    by_exact.setdefault(v, item)
+                    names.append(v)
+                    name_items.append(item)
+        return by_exact, names, name_items
+
+    def find_match(self, name: str) -> Optional[Dict[str, Any]]:
+        name_l = name.lower()
+        by_exact, names, name_items, name_lengths = self._index
+        item = by_exact.get(name_l)
+        if item is not None:
+            return item
+        # Only the shorter string can be inside the longer one, so the stored length picks the one test to run
+        n = len(name_l)
+        for i, (v, length) in enumerate(zip(names, name_lengths)):
+            if (name_l in v) if length >= n else (v in name_l):
+                return name_items[i]
         return None
 
     def calories_for(self, text: str) -> Optional[Tuple[int, str]]:
-        m = re.match(r"\s*(\d+)\s+([\w\s\-]+)\s*$", text.strip(), flags=re.I)
+        text = text.strip()
+        m = _QTY_RE.match(text)
         if not m:
-            qty, item_name = 1, text.strip()
+            qty, item_name = 1, text
         else:
-            qty, item_name = int(m.group(1)), m.group(2).strip()
+            qty, item_name = int(m.group(1)), m.group(2)
 
         match = self.find_match(item_name)
         if not match: